@@ -0,0 +1,180 @@
+# compliance.py
+
+import hashlib
+import json
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Number of switches scanned at the same time
+SCAN_WORKERS = 50
+
+# Results older than this are never reused, even if the fingerprint matches
+FINGERPRINT_MAX_AGE = timedelta(days=7)
+
+# Function to strip the namespace from an XML tag
+def local_name(tag):
+    return tag.split('}')[-1]
+
+# Function to find elements by a path of tag names, ignoring namespaces
+def find_elements(root, path):
+    """Returns the elements reached by following the tag names in path from root."""
+    elements = [root]
+    for tag in path.split('/'):
+        elements = [child for element in elements for child in element if local_name(child.tag) == tag]
+    return elements
+
+# Function to compare an intended element against a running element
+def element_matches(intent, running, keep=None):
+    """Checks that every leaf of the intended element is present in the running element."""
+    if local_name(intent.tag) != local_name(running.tag):
+        return False
+    text = (intent.text or '').strip()
+    if text and text != (running.text or '').strip():
+        return False
+    children = [child for child in intent if keep is None or local_name(child.tag) in keep]
+    return all(any(element_matches(child, candidate) for candidate in running) for child in children)
+
+# Function to compare the intended values at one path
+def path_matches(item, candidate, path):
+    """Checks that every intended element at path is present at the same path in the running item."""
+    intended = find_elements(item, path)
+    running = find_elements(candidate, path)
+    return bool(intended) and all(any(element_matches(want, have) for have in running) for want in intended)
+
+# Function to compare an intended item against a running item
+def item_matches(item, candidate, keep=None):
+    """Checks the list key of the item and the leaves selected by keep."""
+    if keep is None:
+        return element_matches(item, candidate)
+    if not any(element_matches(item[0], child) for child in candidate):
+        return False
+    return all(any(path_matches(item, candidate, path) for path in entry.split('|')) for entry in keep)
+
+# Function to evaluate the checks for one switch
+def evaluate_checks(intent_xml, running_xml, checks):
+    """
+    Compares the running configuration against the intended payload.
+
+    checks maps a check name to a (path, keep) pair: path selects the intended items
+    below the root. keep is None to compare the whole item, or a set of paths below
+    the item limiting the comparison to those leaves; an entry may list alternative
+    paths separated by "|" and passes if any of them matches. The first child of an
+    item, its list key, is always compared. Returns one result per check.
+    """
+    intent_root = ET.fromstring(intent_xml)
+    running_root = ET.fromstring(running_xml)
+    results = []
+    for path, keep in checks.values():
+        failed = []
+        candidates = find_elements(running_root, path)
+        for item in find_elements(intent_root, path):
+            if not any(item_matches(item, candidate, keep) for candidate in candidates):
+                failed.append((item[0].text or '').strip())
+        results.append("Compliant" if not failed else f"Non-compliant: {' '.join(failed)}")
+    return results
+
+# Function to load a JSON state file, such as the fingerprints from a previous scan
+def load_json(filename):
+    try:
+        with open(filename, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+# Function to save a JSON state file for the next run
+def save_json(filename, data):
+    with open(filename, 'w') as file:
+        json.dump(data, file, indent=2)
+
+# Function to drop the fingerprints of switches that were changed
+def forget_fingerprints(filename, hostnames):
+    """Removes the given switches so that the next scan reads them again."""
+    fingerprints = load_json(filename)
+    for hostname in hostnames:
+        fingerprints.pop(hostname, None)
+    save_json(filename, fingerprints)
+
+# Function to fingerprint a switch
+def fingerprint(switch_info, intent_xml):
+    """
+    Hashes the intended payload together with the DNA Center last update time.
+
+    An equal fingerprint only means the intent is the same and DNA Center has not
+    updated its record of the device. Changes made on the device are only seen if
+    DNA Center resynced it, so reused results can miss drift. Returns None when
+    DNA Center did not report a last update time.
+    """
+    if not switch_info[4]:
+        return None
+    return hashlib.sha256(f"{switch_info[4]}\n{intent_xml}".encode()).hexdigest()
+
+# Function to check whether results from a previous scan can be reused
+def reusable(previous, current, checks):
+    """Returns True if the previous record matches the fingerprint, is recent enough and was compliant."""
+    if not previous or not current or previous["fingerprint"] != current or previous["checks"] != list(checks):
+        return False
+    if any(result.startswith("Non-compliant") for result in previous["results"]):
+        return False
+    scanned = datetime.strptime(previous["timestamp"], "%Y-%m-%d_%H-%M-%S")
+    return datetime.now() - scanned <= FINGERPRINT_MAX_AGE
+
+# Function to scan a single switch
+def scan_switch(switch_info, connect, subtree_filter, intent_xml, checks, close):
+    """Reads the relevant subtrees from the switch and evaluates the checks."""
+    device = connect(switch_info)
+    if not device:
+        return ["Failed to connect to the device"] * len(checks)
+    try:
+        running_xml = device.get_config(source='running', filter=('subtree', subtree_filter)).data_xml
+        return evaluate_checks(intent_xml, running_xml, checks)
+    except Exception as e:
+        return [f"Error: {e}"] * len(checks)
+    finally:
+        close(device)
+
+# Function to run a read-only compliance scan across the fleet
+def run_scan(switches, connect, subtree_filter, intent, checks, close, writer, fingerprint_file, full=False, skip=None,
+             log=print):
+    """
+    Scans every switch concurrently and writes a compliance matrix.
+
+    subtree_filter(switch_info) and intent(switch_info) return the get_config filter
+    and the intended payload for a switch. Switches whose fingerprint matches the
+    previous scan, within FINGERPRINT_MAX_AGE, reuse its results unless full is set or
+    they were non-compliant.
+    Reused results are marked with the time of the scan they come from.
+    skip(switch_info), if given, returns a reason for not scanning a switch or None,
+    and log(message) reports progress the way the calling script does.
+    """
+    fingerprints = load_json(fingerprint_file)
+    writer.writerow(["Host"] + list(checks) + ["Scan"])
+
+    def scan(switch_info):
+        hostname = switch_info[1]
+        reason = skip(switch_info) if skip else None
+        if reason:
+            return hostname, [reason] * len(checks), "Skipped", None
+        intent_xml = intent(switch_info)
+        current = fingerprint(switch_info, intent_xml)
+        previous = fingerprints.get(hostname)
+        if not full and reusable(previous, current, checks):
+            return hostname, previous["results"], f"Reused from {previous['timestamp']}", None
+        results = scan_switch(switch_info, connect, subtree_filter(switch_info), intent_xml, checks, close)
+        scanned = all(not result.startswith(("Error", "Failed")) for result in results)
+        record = {
+            "fingerprint": current,
+            "checks": list(checks),
+            "results": results,
+            "timestamp": datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
+        }
+        return hostname, results, "Scanned", record if scanned else None
+
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+        for hostname, results, status, record in executor.map(scan, switches):
+            writer.writerow([hostname] + results + [status])
+            if record:
+                fingerprints[hostname] = record
+            log(f"Compliance {hostname}: {results}")
+
+    save_json(fingerprint_file, fingerprints)
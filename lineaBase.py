@@ -1,4 +1,5 @@
 import time
+import argparse
 import urllib3
 import csv
 import requests
@@ -9,6 +10,8 @@ from datetime import datetime
 import logging
 from config import connection_params_template, DNA_USER, DNA_PASS
 from configDNA import DNA_FQDN, DNA_PORT, DNA_DEVICE_API
+from rollout import run_rollout
+from compliance import run_scan, evaluate_checks, forget_fingerprints
 
 # Function to load switches from CSV
 def load_switches_from_csv(csv_file):
@@ -45,6 +48,11 @@ headers = {'content-type': "application/json", 'x-auth-token': ""}
 def spacer():
     print("+" + "-" * 45 + "+")
 
+# Function to report progress on screen and in the log file
+def log_message(message):
+    print(message)
+    logging.info(message)
+
 # Function for DNA Center authentication
 def authenticate_dna():
     """Authenticates with DNA Center and retrieves authentication token."""
@@ -74,7 +82,7 @@ def get_switch_information(token):
             response.raise_for_status()
             output = response.json()['response']
             for x in output:
-                switch_details.append([x["id"], x["hostname"], x["managementIpAddress"], x["platformId"]])
+                switch_details.append([x["id"], x["hostname"], x["managementIpAddress"], x["platformId"], x.get("lastUpdateTime", "")])
         except requests.exceptions.RequestException as e:
             logging.error(f"Failed to retrieve information for switch {device}: {e}")
     return switch_details
@@ -89,6 +97,11 @@ def connect_to_device(device_params):
         logging.error(f"Failed to connect to {device_params['host']}: {e}")
         return None
 
+# Function to connect to a switch from its DNA Center details
+def connect_switch(switch_info):
+    """Establishes connection to a switch using its management IP address."""
+    return connect_to_device({'host': switch_info[2]})  # Using IP address instead of hostname
+
 # Function to lock configuration on a device
 def lock_configuration(device):
     """Locks the configuration on the device."""
@@ -106,7 +119,7 @@ def lock_configuration(device):
         except Exception as e:
             logging.warning("Locking not supported.")
             tries += 1
-            print("Locking not supported. Retry in " + seconds + " seconds.")
+            print(f"Locking not supported. Retry in {seconds} seconds.")
             time.sleep(seconds)  # Wait for 5 minutes before retrying
     return False
 
@@ -314,11 +327,75 @@ def apply_configuration(device, xml_config):
 # Function to close connection with a device
 def close_connection(device):
     """Closes the session with the device."""
-    device.close_session()
-    logging.info("Connection closed.")
-    print("Closing session")
+    try:
+        device.close_session()
+        logging.info("Connection closed.")
+        print("Closing session")
+    except Exception as e:
+        logging.error(f"Error closing session: {e}")
     spacer()
 
+# Function to push the configuration to a device
+def push_configuration(device, switch_info):
+    """Locks the device, applies the configuration and unlocks it."""
+    if not lock_configuration(device):
+        return "Unable to lock configuration", ""
+    print("Generating config")
+    xml_config = generate_xml_config()
+    spacer()
+    result, error = apply_configuration(device, xml_config)
+    unlock_configuration(device)
+    spacer()
+    return result, error
+
+# Subtrees changed by generate_xml_config: ACL 21, the VTY lines and the NTP servers
+VERIFY_FILTER = '''
+    <native xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-native">
+        <ip>
+            <access-list>
+                <standard xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-acl">
+                    <name>21</name>
+                </standard>
+            </access-list>
+        </ip>
+        <line>
+            <vty/>
+        </line>
+        <ntp>
+            <server xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-ntp"/>
+        </ntp>
+    </native>
+'''
+
+# File keeping the fingerprints of the last compliance scan
+COMPLIANCE_FILE = 'compliance_lineaBase.json'
+
+# Compliance checks against generate_xml_config, comparing only the leaves that carry each setting.
+# None of these forms has been checked against a device read-back yet.
+COMPLIANCE_CHECKS = {
+    "ACL 21": ("native/ip/access-list/standard", None),
+    "VTY": ("native/line/vty", {"last", "transport/input/input", "session-timeout/session-timeout-value"}),
+    "NTP": ("native/ntp/server/server-list", None),
+}
+
+# Function to verify the configuration after a change
+def verify_configuration(switch_info):
+    """Reconnects to the device and compares the changed subtrees against the intended configuration."""
+    device = connect_switch(switch_info)
+    if not device:
+        return False, "Unreachable after change"
+    try:
+        data = device.get_config(source='running', filter=('subtree', VERIFY_FILTER)).data_xml
+        results = evaluate_checks(generate_xml_config(), data, COMPLIANCE_CHECKS)
+        failed = [f"{check} {result}" for check, result in zip(COMPLIANCE_CHECKS, results) if result != "Compliant"]
+        if failed:
+            return False, "; ".join(failed)
+        return True, ""
+    except Exception as e:
+        return False, str(e)
+    finally:
+        close_connection(device)
+
 # Function to write results to CSV file
 def write_to_csv(filename, results):
     with open(filename, mode='a', newline='') as file:
@@ -345,30 +422,46 @@ def main():
 
     with open(filename, mode='w', newline='') as file:
         writer = csv.writer(file)
-        writer.writerow(["Host", "Result", "Error"])
+        writer.writerow(["Host", "Result", "Error", "Verification"])
 
-        for switch_info in switches:
-            hostname, series, ip = switch_info[1], switch_info[3], switch_info[2]
-            device_params = {'host': ip}  # Using IP address instead of hostname
-            print("Connecting to "+ hostname)
-            spacer()
-            device = connect_to_device(device_params)
-            if device:
-                if lock_configuration(device):
-                    print("Generating config")
-                    xml_config = generate_xml_config()  # Passing switch_ports for XML generation
-                    spacer()
-                    result, error = apply_configuration(device, xml_config)
-                    unlock_configuration(device)
-                    writer.writerow([hostname, result, error])
-                    spacer()
-                else:
-                    writer.writerow([hostname, "Unable to lock configuration", ""])
-                close_connection(device)
-            else:
-                writer.writerow([hostname, "Failed to connect to the device", ""])
+        # Push in waves, starting with a canary switch
+        run_rollout(switches, connect_switch, push_configuration, verify_configuration, close_connection, writer,
+                    log=log_message)
+
+    # Pushed switches must be read again by the next compliance scan
+    forget_fingerprints(COMPLIANCE_FILE, [switch_info[1] for switch_info in switches])
 
     logging.info(f"Results saved to {filename}")
 
+# Compliance scan
+def scan(full=False):
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    filename = f"compliance_results_{timestamp}.csv"
+
+    # Authenticate with DNA Center
+    token = authenticate_dna()
+
+    # Retrieve switch information
+    switches = get_switch_information(token)
+    logging.info("Switches:")
+    logging.info(switches)
+
+    spacer()
+
+    with open(filename, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        run_scan(switches, connect_switch, lambda switch_info: VERIFY_FILTER, lambda switch_info: generate_xml_config(),
+                 COMPLIANCE_CHECKS, close_connection, writer, COMPLIANCE_FILE, full, log=log_message)
+
+    print(f"Compliance results saved to {filename}")
+    logging.info(f"Compliance results saved to {filename}")
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scan', action='store_true', help="Read-only compliance scan instead of pushing")
+    parser.add_argument('--full', action='store_true', help="Scan every switch, including unchanged ones")
+    args = parser.parse_args()
+    if args.scan:
+        scan(args.full)
+    else:
+        main()
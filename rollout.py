@@ -0,0 +1,121 @@
+# rollout.py
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Wave sizes, the first wave is the canary and the last size repeats until every switch is covered
+ROLLOUT_WAVES = [1, 5, 10, 25]
+
+# Fraction of pushed switches allowed to fail, in a wave or overall, before the rollout halts
+FAILURE_THRESHOLD = 0.2
+
+# Results for switches that were left unchanged because the push never started
+PRE_PUSH_RESULTS = ("Failed to connect to the device", "Unable to lock configuration")
+
+# Function to get the size of a rollout wave
+def wave_size(stage, wave_sizes=ROLLOUT_WAVES):
+    """Returns the wave size for a stage, the last size repeats for later stages."""
+    return wave_sizes[min(stage, len(wave_sizes) - 1)]
+
+# Function to push the configuration to a single switch
+def push_switch(switch_info, device, push, close, log=print):
+    """Pushes the configuration through an open connection and closes it."""
+    if not device:
+        return "Failed to connect to the device", ""
+    try:
+        return push(device, switch_info)
+    except Exception as e:
+        return "Error", str(e)
+    finally:
+        close_quietly(device, close, log)
+
+# Function to verify a single switch
+def verify_switch(switch_info, verify):
+    """Runs the verification, reporting any exception as a failed check."""
+    try:
+        return verify(switch_info)
+    except Exception as e:
+        return False, str(e)
+
+# Function to close a connection without raising
+def close_quietly(device, close, log=print):
+    """Closes the connection, reporting instead of raising if the session already dropped."""
+    try:
+        close(device)
+    except Exception as e:
+        log(f"Error closing connection: {e}")
+
+# Function to close connections opened for a wave that will not run
+def discard_connections(pending, close, log=print):
+    """Closes the connections prepared for a wave that was halted."""
+    for future in pending:
+        device = future.result()
+        if device:
+            close_quietly(device, close, log)
+
+# Function to run the rollout wave by wave
+def run_rollout(switches, connect, push, verify, close, writer,
+                wave_sizes=ROLLOUT_WAVES, failure_threshold=FAILURE_THRESHOLD, log=print):
+    """
+    Pushes the configuration in waves, starting with a canary wave.
+
+    connect(switch_info) returns an open device or None, push(device, switch_info)
+    returns a (result, error) pair with result "Success" on success, verify(switch_info)
+    returns a (passed, detail) pair, close(device) ends the session and log(message)
+    reports progress the way the calling script does.
+    After each wave the pushed switches are verified while the connections for the
+    next wave are being set up. The rollout halts on any failure in the canary wave,
+    or once the share of failed switches in the last wave or in the whole rollout
+    crosses failure_threshold. Switches that could not be reached or locked are
+    recorded but do not count as failures, and waves stay at canary size until a
+    switch has actually been pushed. Returns True if every wave was run.
+    """
+    stage = 0
+    index = 0
+    attempted = 0
+    failures = 0
+    number = 0
+    wave = switches[:wave_size(stage, wave_sizes)]
+    with ThreadPoolExecutor(max_workers=2 * max(wave_sizes)) as executor:
+        pending = [executor.submit(connect, switch_info) for switch_info in wave]
+        while wave:
+            number += 1
+            index += len(wave)
+            log(f"Wave {number}: {[switch_info[1] for switch_info in wave]}")
+            devices = [future.result() for future in pending]
+            pushed = list(executor.map(lambda item: push_switch(item[0], item[1], push, close, log), zip(wave, devices)))
+
+            # Verify this wave while the next wave connects, growing the waves only once a switch was pushed
+            checks = [executor.submit(verify_switch, switch_info, verify) if result == "Success" else None
+                      for switch_info, (result, error) in zip(wave, pushed)]
+            wave_attempted = sum(result not in PRE_PUSH_RESULTS for result, error in pushed)
+            canary = stage == 0
+            if wave_attempted:
+                stage += 1
+            next_wave = switches[index:index + wave_size(stage, wave_sizes)]
+            pending = [executor.submit(connect, switch_info) for switch_info in next_wave]
+
+            wave_failures = 0
+            for switch_info, (result, error), check in zip(wave, pushed, checks):
+                if check:
+                    passed, detail = check.result()
+                    verification = "Verified" if passed else f"Verification failed: {detail}"
+                else:
+                    passed, verification = False, "Not verified"
+                if not passed and result not in PRE_PUSH_RESULTS:
+                    wave_failures += 1
+                writer.writerow([switch_info[1], result, error, verification])
+            attempted += wave_attempted
+            failures += wave_failures
+
+            if ((canary and wave_failures)
+                    or (wave_attempted and wave_failures / wave_attempted > failure_threshold)
+                    or (attempted and failures / attempted > failure_threshold)):
+                message = (f"Rollout halted after wave {number}: {wave_failures}/{wave_attempted} failed in the wave, "
+                           f"{failures}/{attempted} pushed switches failed overall")
+                log(message)
+                discard_connections(pending, close, log)
+                for switch_info in switches[index:]:
+                    writer.writerow([switch_info[1], "Skipped: rollout halted", "", ""])
+                return False
+            wave = next_wave
+    return True
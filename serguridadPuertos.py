@@ -1,13 +1,17 @@
 import time
+import argparse
 import urllib3
 import csv
 import requests
 import re
+import hashlib
 from requests.auth import HTTPBasicAuth
 from ncclient import manager
 from datetime import datetime
 from config import connection_params_template,DNA_USER, DNA_PASS
 from configDNA import DNA_FQDN, DNA_PORT, DNA_DEVICE_API, DNA_INTERFACE_API
+from rollout import run_rollout
+from compliance import run_scan, evaluate_checks, forget_fingerprints, load_json, save_json
 
 # Disable SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -67,7 +71,7 @@ def get_switches(token):
             response.raise_for_status()
             output = response.json()['response']
             for x in output:
-                switch_details.append([x["id"], x["hostname"], x["managementIpAddress"], x["platformId"]])
+                switch_details.append([x["id"], x["hostname"], x["managementIpAddress"], x["platformId"], x.get("lastUpdateTime", "")])
         except requests.exceptions.RequestException as e:
             print(f"Failed to retrieve information for switch {device}: {e}")
     return switch_details
@@ -107,7 +111,7 @@ def get_Interfaces(switches, token):
         print(switch)
         spacer()
         try:
-            id, hostname, ip, platform = switch
+            id, hostname, ip, platform = switch[:4]
             print("Interfaces:\n")
             interfaces = network_interfaces(token, id, hostname, platform)
             switch_port.append(interfaces[2])
@@ -116,7 +120,8 @@ def get_Interfaces(switches, token):
             access = interfaces[2]
 
         except Exception as e:
-            switch_port.append([])
+            print(f"Failed to retrieve interfaces for switch {switch[1]}: {e}")
+            switch_port.append(None)  # None marks a failed lookup, [] a switch without access ports
     return switch_port
 
 
@@ -132,6 +137,11 @@ def connect_to_device(device_params):
         print(f"Failed to connect to {device_params['host']}: {e}")
         return None
 
+# Function to connect to a switch from its DNA Center details
+def connect_switch(switch_info):
+    """Establishes connection to a switch using its management IP address."""
+    return connect_to_device({'host': switch_info[2]})  # Using IP address instead of hostname
+
 # Function to lock configuration on a device
 def lock_configuration(device):
     """Locks the configuration on the device."""
@@ -158,6 +168,50 @@ def unlock_configuration(device):
     except Exception as e:
         print(f"Error unlocking configuration: {e}")
 
+# File keeping the access ports of every switch as of its last successful push
+PORT_INDEX_FILE = 'port_index.json'
+
+# Function to hash the access ports of a switch
+def ports_hash(ports):
+    return hashlib.sha256("\n".join(sorted(ports)).encode()).hexdigest()
+
+# Function to select the ports to push in incremental mode
+def changed_ports(index, switch_info, ports):
+    """Returns the ports not covered by the last successful push to the switch."""
+    entry = index.get(switch_info[0])
+    if not entry or entry["template_version"] != port_template_version():
+        return ports
+    if entry["ports_hash"] == ports_hash(ports):
+        return []
+    return [port for port in ports if port not in entry["ports"]]
+
+# Function to record ports removed from a switch
+def refresh_port_index(index, switch_info, ports):
+    """Stores the current ports of a switch that only lost ports, keeping its last success time."""
+    entry = index.get(switch_info[0])
+    if entry and entry["template_version"] == port_template_version() and entry["ports_hash"] != ports_hash(ports):
+        entry["ports"] = ports
+        entry["ports_hash"] = ports_hash(ports)
+
+# Function to update the port index from the results file
+def update_port_index(index, filename, switches, ports, timestamp):
+    """Records the current ports of every switch that was pushed and verified."""
+    switch_ports = {switch_info[1]: (switch_info[0], access) for switch_info, access in zip(switches, ports)}
+    with open(filename, 'r', newline='') as file:
+        for row in csv.DictReader(file):
+            if row["Result"] == "Success" and row["Verification"] == "Verified" and row["Host"] in switch_ports:
+                id, access = switch_ports[row["Host"]]
+                if access is None:
+                    continue
+                index[id] = {
+                    "hostname": row["Host"],
+                    "ports": access,
+                    "ports_hash": ports_hash(access),
+                    "template_version": port_template_version(),
+                    "last_success": timestamp,
+                }
+    return index
+
 # Function to generate XML configuration for interfaces
 def generate_XML(ports):
     """Generates XML configuration for the given interfaces."""
@@ -253,6 +307,11 @@ def generate_XML(ports):
 
 
 
+# Function to get the version of the interface template
+def port_template_version():
+    """Hashes the generate_XML template, so any change to it invalidates the port index."""
+    return ports_hash([generate_XML(["{port}"])])
+
 # Function to apply configuration to a device
 def apply_configuration(device, xml_config):
     """Applies the configuration to the device."""
@@ -265,11 +324,75 @@ def apply_configuration(device, xml_config):
 # Function to close connection with a device
 def close_connection(device):
     """Closes the session with the device."""
-    device.close_session()
-    print("Connection closed.")
+    try:
+        device.close_session()
+        print("Connection closed.")
+    except Exception as e:
+        print(f"Error closing session: {e}")
+
+# Function to push the port configuration to a device
+def push_configuration(device, switch_info):
+    """Locks the device, applies the port configuration and unlocks it."""
+    if not lock_configuration(device):
+        return "Unable to lock configuration", ""
+    xml_config = generate_XML(switch_info[5])  # Passing switch_ports for XML generation
+    result = apply_configuration(device, xml_config)
+    unlock_configuration(device)
+    return result, ""
+
+# Function to generate the subtree filter for the given interfaces
+def generate_filter(ports):
+    """Generates a subtree filter reading back the given interfaces."""
+    return '''
+        <native xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-native">
+            <interface>
+                {}
+            </interface>
+        </native>
+    '''.format(''.join(f"<GigabitEthernet><name>{interface_name}</name></GigabitEthernet>" for interface_name in ports))
+
+# File keeping the fingerprints of the last compliance scan
+COMPLIANCE_FILE = 'compliance_puertos.json'
+
+# Compliance checks against generate_XML, comparing only the leaves that carry each setting.
+# generate_XML writes some settings in more than one form, "|" accepts any of them since
+# none of these forms has been checked against a device read-back yet.
+COMPLIANCE_CHECKS = {
+    "Port-security": ("native/interface/GigabitEthernet", {
+        "switchport/mode/access",
+        "switchport/port-security/maximum|switchport/port-security-conf/port-security/maximum",
+    }),
+    "Dot1x": ("native/interface/GigabitEthernet", {
+        "dot1x/pae",
+        "access-session/port-control|access-session/port-control-config",
+        "access-session/control-direction|access-session/control-direction-config",
+        "mab",
+    }),
+}
+
+# Function to verify the port configuration after a change
+def verify_configuration(switch_info):
+    """Reconnects to the device and compares the changed interfaces against the intended configuration."""
+    ports = switch_info[5]
+    device = connect_switch(switch_info)
+    if not device:
+        return False, "Unreachable after change"
+    try:
+        if not ports:
+            return True, ""
+        data = device.get_config(source='running', filter=('subtree', generate_filter(ports))).data_xml
+        results = evaluate_checks(generate_XML(ports), data, COMPLIANCE_CHECKS)
+        failed = [f"{check} {result}" for check, result in zip(COMPLIANCE_CHECKS, results) if result != "Compliant"]
+        if failed:
+            return False, "; ".join(failed)
+        return True, ""
+    except Exception as e:
+        return False, str(e)
+    finally:
+        close_connection(device)
 
 # Main script
-def main():
+def main(incremental=False):
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     filename = f"netconf_results_{timestamp}.csv"
 
@@ -289,27 +412,79 @@ def main():
 
     spacer()
 
+    index = load_json(PORT_INDEX_FILE)
+
     with open(filename, mode='w', newline='') as file:
         writer = csv.writer(file)
-        writer.writerow(["Host", "Result", "Error"])
+        writer.writerow(["Host", "Result", "Error", "Verification"])
 
+        # ROLL OUT IN WAVES, ports are carried as the sixth field of each switch
+        targets = []
         for switch_info, switch_ports in zip(switches, ports):
-            hostname, series, ip = switch_info[1], switch_info[3], switch_info[2]
-            device_params = {'host': ip}  # Using IP address instead of hostname
-            device = connect_to_device(device_params)
-            if device:
-                if lock_configuration(device):
-                    xml_config = generate_XML(switch_ports)  # Passing switch_ports for XML generation
-                    result = apply_configuration(device, xml_config)
-                    unlock_configuration(device)
-                    writer.writerow([hostname, result, ""])
-                else:
-                    writer.writerow([hostname, "Unable to lock configuration", ""])
-                close_connection(device)
-            else:
-                writer.writerow([hostname, "Failed to connect to the device", ""])
+            if switch_ports is None:
+                writer.writerow([switch_info[1], "Skipped: interface lookup failed", "", ""])
+                continue
+            if incremental:
+                # Only the ports added since the last successful push
+                current_ports = switch_ports
+                switch_ports = changed_ports(index, switch_info, current_ports)
+                if not switch_ports:
+                    refresh_port_index(index, switch_info, current_ports)
+                    writer.writerow([switch_info[1], "Skipped: no new access ports", "", ""])
+                    continue
+            targets.append(switch_info + [switch_ports])
+        run_rollout(targets, connect_switch, push_configuration, verify_configuration, close_connection, writer)
+
+    # PUSHED SWITCHES MUST BE READ AGAIN BY THE NEXT COMPLIANCE SCAN
+    forget_fingerprints(COMPLIANCE_FILE, [switch_info[1] for switch_info in targets])
+
+    # UPDATE PORT INDEX
+    save_json(PORT_INDEX_FILE, update_port_index(index, filename, switches, ports, timestamp))
 
     print(f"Results saved to {filename}")
 
+# Function to tell why a switch cannot be scanned
+def scan_skip_reason(switch_info):
+    """Returns the reason for not scanning a switch, or None if it has access ports."""
+    if switch_info[5] is None:
+        return "Interface lookup failed"
+    if not switch_info[5]:
+        return "No access ports"
+    return None
+
+# Compliance scan
+def scan(full=False):
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    filename = f"compliance_results_{timestamp}.csv"
+
+    # GET DNA TOKEN
+    token = dnac_token()
+
+    # GET SWITCHES INFORMATION
+    switches = get_switches(token)
+
+    # GET PORTS INFORMATION
+    ports = get_Interfaces(switches, token)
+
+    spacer()
+
+    with open(filename, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        targets = [switch_info + [switch_ports] for switch_info, switch_ports in zip(switches, ports)]
+        run_scan(targets, connect_switch, lambda switch_info: generate_filter(switch_info[5]),
+                 lambda switch_info: generate_XML(switch_info[5]), COMPLIANCE_CHECKS, close_connection, writer,
+                 COMPLIANCE_FILE, full,
+                 skip=scan_skip_reason)
+
+    print(f"Compliance results saved to {filename}")
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scan', action='store_true', help="Read-only compliance scan instead of pushing")
+    parser.add_argument('--full', action='store_true', help="Scan every switch, including unchanged ones")
+    parser.add_argument('--incremental', action='store_true', help="Push only the access ports added since the last successful push")
+    args = parser.parse_args()
+    if args.scan:
+        scan(args.full)
+    else:
+        main(args.incremental)